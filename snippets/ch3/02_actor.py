@@ -1,6 +1,7 @@
 import multiprocessing as mp
-from queue import Empty
+from typing import Callable
 
+import numpy as np
 import torch
 from pathlib import Path
 
@@ -10,22 +11,63 @@ from lerobot.policies.sac.reward_model.modeling_classifier import Classifier
 from lerobot.rl.gym_manipulator import make_robot_env
 from lerobot.teleoperators.utils import TeleopEvents
 
+from utils import ParameterBank, TransitionRing, module_tensors, normalize_images
+
 MAX_EPISODES = 5
 MAX_STEPS_PER_EPISODE = 20
 
-def make_policy_obs(obs, device: torch.device = "cpu"):
-    return {
-        "observation.state": torch.from_numpy(obs["agent_pos"]).float().unsqueeze(0).to(device),
-        **{
-            f"observation.image.{k}": 
-                torch.from_numpy(obs["pixels"][k]).float().unsqueeze(0).to(device)
-            for k in obs["pixels"]
-        },
-    }
-
+def make_policy_obs_fn(observation_space, device: torch.device) -> Callable[[dict], dict]:
+    """Specializes the batching of raw observations into tensors to the available cameras,
+    which are fixed for the whole run. On CUDA, all frames are first copied into pinned buffers,
+    and then sent to `device` back to back, asynchronously. Frames are kept uint8 (4x fewer
+    bytes to move), see `normalize_images`."""
+    camera_names = sorted(observation_space["pixels"].keys())
+    cameras = tuple((k, f"observation.images.{k}") for k in camera_names)
+
+    if device.type != "cuda":
+        def make_policy_obs(obs):
+            state = obs["agent_pos"].astype(np.float32)
+            policy_obs = {"observation.state": torch.from_numpy(state)}
+            for camera, key in cameras:
+                policy_obs[key] = torch.from_numpy(obs["pixels"][camera])
+            return {k: v.unsqueeze(0).to(device) for k, v in policy_obs.items()}
+
+        return make_policy_obs
+
+    state_shape = observation_space["agent_pos"].shape
+    staging = {"observation.state": torch.empty(state_shape, pin_memory=True)}
+    for camera, key in cameras:
+        shape = observation_space["pixels"][camera].shape
+        staging[key] = torch.empty(shape, dtype=torch.uint8, pin_memory=True)
+    state_buffer = staging["observation.state"].numpy()
+    camera_buffers = tuple((camera, staging[key].numpy()) for camera, key in cameras)
+
+    def make_policy_obs(obs):
+        np.copyto(state_buffer, obs["agent_pos"])
+        for camera, buffer in camera_buffers:
+            np.copyto(buffer, obs["pixels"][camera])
+        return {k: v.to(device, non_blocking=True).unsqueeze(0) for k, v in staging.items()}
+
+    return make_policy_obs
+
+def synchronize(device: torch.device):
+    if device.type == "cuda":
+        torch.cuda.current_stream().synchronize()
+    elif device.type == "mps":
+        torch.mps.synchronize()
+
+def launch(fn, *args, stream: torch.cuda.Stream | None = None):
+    """Queues `fn` on `stream` (if any), after all the work queued on the current stream."""
+    if stream is None:
+        return fn(*args)
+    stream.wait_stream(torch.cuda.current_stream())
+    with torch.cuda.stream(stream):
+        return fn(*args)
+
+@torch.inference_mode()  # the actor never backpropagates, no need to track gradients
 def run_actor(
-    transitions_queue: mp.Queue,
-    parameters_queue: mp.Queue,
+    transitions_ring: TransitionRing,
+    parameter_bank: ParameterBank,
     shutdown_event: mp.Event,
     policy_actor: SACPolicy,
     reward_classifier: Classifier,
@@ -34,55 +76,89 @@ def run_actor(
     output_directory: Path | None = None
 ):
     """The actor process - interacts with environment and collects data.
-    The policy is frozen and only the parameters are updated, popping the most recent ones 
-    from a queue."""
+    The policy is frozen and only the parameters are updated, copying the most recent ones 
+    from shared memory."""
+    device = torch.device(device)
     policy_actor.eval()
-    policy_actor.to(device)
+    # Weights are received in half precision, and the policy runs in that precision as well
+    policy_actor.to(device=device, dtype=parameter_bank.dtype)
+    actor_tensors = module_tensors(policy_actor)  # updated in place with the learner's weights
 
     reward_classifier.eval()
     reward_classifier.to(device)
 
+    # Inputs have static shapes (one observation at a time), so graphs are compiled only once.
+    # Parameters are updated in place, so compiled graphs (and CUDA graphs) survive updates
+    select_action = torch.compile(
+        torch.autocast(device.type, dtype=parameter_bank.dtype)(policy_actor.select_action),
+        mode="reduce-overhead",
+        dynamic=False,
+    )
+    predict_reward = torch.compile(
+        reward_classifier.predict_reward, mode="reduce-overhead", dynamic=False
+    )
+
     # Create robot environment inside the actor process
     env, teleop_device = make_robot_env(env_cfg)
+    params_version = 0
+
+    make_policy_obs = make_policy_obs_fn(env.observation_space, device)
+
+    # Host copy of the action, reused at every step (and pinned on CUDA, for a faster copy)
+    action_host = torch.empty(env.action_space.shape, pin_memory=device.type == "cuda")
+    # Side stream for the policy, overlapping with both the reward classifier and robot I/O
+    inference_stream = torch.cuda.Stream() if device.type == "cuda" else None
 
     try:
         for episode in range(MAX_EPISODES):
             if shutdown_event.is_set():
                 break
 
+            # Reserve a slot in shared memory to write this episode's transitions into
+            slot = None
+            while slot is None and not shutdown_event.is_set():
+                slot = transitions_ring.reserve(timeout=0.1)
+            if slot is None:
+                break
+
             obs, _info = env.reset()
+            policy_obs = make_policy_obs(obs)
+            # predicts a single action, not a chunk of actions!
+            action_tensor = launch(
+                select_action, normalize_images(policy_obs), stream=inference_stream
+            )
             episode_reward = 0.0
             step = 0
-            episode_transitions = []
+            n_autonomous, n_interventions = 0, 0
 
             print(f"[ACTOR] Starting episode {episode + 1}")
 
             while step < MAX_STEPS_PER_EPISODE and not shutdown_event.is_set():
-                try:
-                    new_params = parameters_queue.get_nowait()
-                    policy_actor.load_state_dict(new_params)
-                    print("[ACTOR] Updated policy parameters from learner")
-                except Empty:  # No new updated parameters available from learner, waiting
-                    pass
-
-                # Get action from policy
-                policy_obs = make_policy_obs(obs, device=device)
-                # predicts a single action, not a chunk of actions!
-                action_tensor = policy_actor.select_action(policy_obs)
-                action = action_tensor.squeeze(0).cpu().numpy()
+                # Get action from policy, computed while the previous step was being processed
+                if inference_stream is not None:
+                    torch.cuda.current_stream().wait_stream(inference_stream)
+                action_host.copy_(action_tensor.squeeze(0), non_blocking=True)
+                synchronize(device)  # the only wait on the device before acting
 
                 # Step environment
+                action = action_host.numpy()
                 next_obs, _env_reward, terminated, truncated, _info = env.step(action)
                 done = terminated or truncated
 
-                # Predict reward
-                policy_next_obs = make_policy_obs(next_obs, device=device)
-                reward = reward_classifier.predict_reward(policy_next_obs)
+                # No-op unless the learner published new parameters since the last update
+                new_version = parameter_bank.load_into(actor_tensors, params_version)
+                if new_version != params_version:
+                    params_version = new_version
+                    print("[ACTOR] Updated policy parameters from learner")
 
-                if reward >= 1.0:  # success detected! halt episode
-                    if not done:
-                        terminated = True
-                        done = True
+                # Predict reward, and start computing the next action already (pipelining).
+                # Both run on device while polling the teleop (action dropped if episode ends)
+                policy_next_obs = make_policy_obs(next_obs)
+                model_next_obs = normalize_images(policy_next_obs)  # once, for both models
+                # CUDA graph outputs are overwritten by the next graph run, and the reward is
+                # read after `select_action` runs: keep a copy (queued on device, no sync)
+                reward = predict_reward(model_next_obs).clone()
+                action_tensor = launch(select_action, model_next_obs, stream=inference_stream)
 
                 # In HIL-SERL, human interventions come from the teleop device
                 is_intervention = False
@@ -91,11 +167,17 @@ def run_actor(
                     teleop_events = teleop_device.get_teleop_events()
                     is_intervention = teleop_events.get(TeleopEvents.IS_INTERVENTION, False)
 
-                # Store transition with intervention metadata
+                if reward >= 1.0:  # success detected! halt episode
+                    if not done:
+                        terminated = True
+                        done = True
+
+                # Store transition with intervention metadata, in place in the shared ring.
+                # Transitions are partitioned as they are collected, see `TransitionRing`
                 transition = {
                     "state": policy_obs,
-                    "action": action,
-                    "reward": float(reward) if hasattr(reward, "item") else reward,
+                    "action": action_host,
+                    "reward": reward,
                     "next_state": policy_next_obs,
                     "done": done,
                     "truncated": truncated,
@@ -103,19 +185,22 @@ def run_actor(
                         "is_intervention": is_intervention,
                     },
                 }
-
-                episode_transitions.append(transition)
+                index = n_interventions if is_intervention else n_autonomous
+                transitions_ring.write(slot, index, transition, is_intervention)
+                n_interventions += is_intervention
+                n_autonomous += not is_intervention
 
                 episode_reward += reward
                 step += 1
 
-                obs = next_obs
+                # Next observation is already on device, no need to convert it again
+                policy_obs = policy_next_obs
 
                 if done:
                     break
 
-            # Send episode transitions to learner
-            transitions_queue.put_nowait(episode_transitions)
+            # Publish episode transitions to learner
+            transitions_ring.push(n_autonomous, n_interventions)
 
     except KeyboardInterrupt:
         print("[ACTOR] Interrupted by user")
@@ -126,7 +211,9 @@ def run_actor(
         if teleop_device and hasattr(teleop_device, "disconnect"):
             teleop_device.disconnect()
         if output_directory is not None:
-            policy_actor.save_pretrained(output_directory)
-            print(f"[ACTOR] Latest actor policy saved at: {output_directory}")
+            # Saved in float32, but the weights are lossy: rounded to the (half) precision they
+            # were shared in. Save the learner's policy for full precision weights instead
+            policy_actor.to(torch.float32).save_pretrained(output_directory)
+            print(f"[ACTOR] Latest actor policy saved at: {output_directory} (half precision)")
         
         print("[ACTOR] Actor process finished")
\ No newline at end of file
@@ -1,80 +1,116 @@
 import multiprocessing as mp
-from queue import Empty, Full
 
 import torch
 import torch.optim as optim
 
 from lerobot.policies.sac.modeling_sac import SACPolicy
-from lerobot.rl.buffer import ReplayBuffer
+
+from utils import (
+    BatchedReplayBuffer,
+    ParameterBank,
+    TransitionRing,
+    module_tensors,
+    normalize_images,
+    tree_map,
+)
 
 LOG_EVERY = 10
 SEND_EVERY = 10
 
 def run_learner(
-    transitions_queue: mp.Queue,
-    parameters_queue: mp.Queue,
+    transitions_ring: TransitionRing,
+    parameter_bank: ParameterBank,
     shutdown_event: mp.Event,
     policy_learner: SACPolicy,
-    online_buffer: ReplayBuffer,
-    offline_buffer: ReplayBuffer,
+    online_buffer: BatchedReplayBuffer,
+    offline_buffer: BatchedReplayBuffer,
     lr: float = 3e-4,
     batch_size: int = 32,
     device: torch.device = "mps",
 ):
     """The learner process - trains SAC policy on transitions streamed from the actor, 
     updating parameters for the actor to adopt."""
+    device = torch.device(device)
     policy_learner.train()
     policy_learner.to(device)
+    learner_tensors = module_tensors(policy_learner)  # shared with the actor, see SEND_EVERY
 
-    # Create Adam optimizer from scratch - simple and clean
-    optimizer = optim.Adam(policy_learner.parameters(), lr=lr)
+    # Create Adam optimizer from scratch - simple and clean.
+    # Updates all parameters with one fused kernel on CUDA, batching them (foreach) otherwise
+    fused = device.type == "cuda"
+    optimizer = optim.Adam(policy_learner.parameters(), lr=lr, fused=fused, foreach=not fused)
 
     print(f"[LEARNER] Online buffer capacity: {online_buffer.capacity}")
     print(f"[LEARNER] Offline buffer capacity: {offline_buffer.capacity}")
 
+    # On CUDA, weights are copied to pinned host memory on a side stream, and only published
+    # once the copy is over, without ever stalling training on it
+    copy_stream, copy_done = None, None
+    if device.type == "cuda":
+        copy_stream = torch.cuda.Stream()
+        # Staged in the (half) precision weights are shared in, halving the bytes copied
+        staging = [
+            torch.empty(shared.shape, dtype=shared.dtype, pin_memory=True)
+            for shared in parameter_bank.banks[0]
+        ]
+
     training_step = 0
+    batch = None
 
     while not shutdown_event.is_set():
-        # retrieve incoming transitions from the actor process
-        try:
-            transitions = transitions_queue.get(timeout=0.1)
-            for transition in transitions:
-                # HIL-SERL: Add ALL transitions to online buffer
-                online_buffer.add(**transition)
-
-                # HIL-SERL: Add ONLY human intervention transitions to offline buffer
-                is_intervention = \
-                    transition.get("complementary_info", {}).get("is_intervention", False)
-                if is_intervention:
-                    offline_buffer.add(**transition)
-                    print(
-                        f"[LEARNER] Human intervention detected!"
-                        f"Added to offline buffer (now {len(offline_buffer)} transitions)"
-                    )
-
-        except Empty:
-            pass  # No transitions available, continue
+        # retrieve incoming transitions from the actor process, reading them from shared memory
+        episode = transitions_ring.pop(timeout=0.1)
+        if episode is not None:
+            # Transitions come already partitioned by the actor, one batch for each kind
+            autonomous, interventions = episode
+            for transitions in episode:
+                # Frames travel as uint8, and are only stored as floats in [0, 1] in the buffers
+                transitions["state"] = normalize_images(transitions["state"])
+                transitions["next_state"] = normalize_images(transitions["next_state"])
+
+            # HIL-SERL: Add ALL transitions to online buffer
+            online_buffer.add_batch(autonomous)
+            online_buffer.add_batch(interventions)
+
+            # HIL-SERL: Add ONLY human intervention transitions to offline buffer
+            if len(interventions["reward"]) > 0:
+                offline_buffer.add_batch(interventions)
+                print(
+                    f"[LEARNER] Human intervention detected! "
+                    f"Added to offline buffer (now {len(offline_buffer)} transitions)"
+                )
+
+            # Buffers hold their own copy of the transitions: the actor can reuse the slot
+            transitions_ring.release()
 
         # Train if we have enough data
         if len(online_buffer) >= policy_learner.config.online_step_before_learning:
-            # Sample from online buffer (autonomous + human data)
-            online_batch = online_buffer.sample(batch_size // 2)
-
-            # Sample from offline buffer (human demonstrations only)
-            offline_batch = offline_buffer.sample(batch_size // 2)
+            if batch is None:  # preallocated once, then filled in place at every step
+                batch = online_buffer.empty_batch(batch_size, device=device)
+                online_half = tree_map(lambda field: field[: batch_size // 2], batch)
+                offline_half = tree_map(lambda field: field[batch_size // 2 :], batch)
 
             # Combine batches - this is the key HIL-SERL mechanism!
-            batch = {}
-            for key in online_batch.keys():
-                if key in offline_batch:
-                    batch[key] = torch.cat([online_batch[key], offline_batch[key]], dim=0)
-                else:
-                    batch[key] = online_batch[key]
+            # Half sampled from online buffer (autonomous + human data)
+            online_idx = torch.randint(
+                len(online_buffer), (batch_size // 2,), device=online_buffer.storage_device
+            )
+            online_buffer.gather_into(online_half, online_idx)
+
+            # Half sampled from offline buffer (human demonstrations only)
+            offline_idx = torch.randint(
+                len(offline_buffer),
+                (batch_size - batch_size // 2,),
+                device=offline_buffer.storage_device,
+            )
+            offline_buffer.gather_into(offline_half, offline_idx)
 
             loss, _ = policy_learner.forward(batch)
 
             optimizer.zero_grad()
             loss.backward()
+            if copy_done is not None:  # weights still being copied, see below
+                torch.cuda.current_stream().wait_event(copy_done)
             optimizer.step()
             training_step += 1
 
@@ -84,14 +120,21 @@ def run_learner(
                     f"Buffers: Online={len(online_buffer)}, Offline={len(offline_buffer)}"
                 )
 
-            # Send updated parameters to actor every 10 training steps
-            if training_step % SEND_EVERY == 0:
-                try:
-                    state_dict = {k: v.cpu() for k, v in policy_learner.state_dict().items()}
-                    parameters_queue.put_nowait(state_dict)
-                    print("[LEARNER] Sent updated parameters to actor")
-                except Full:
-                    # Missing write due to queue not being consumed (should happen rarely)
-                    pass
+            # Send updated parameters to actor every 10 training steps, via shared memory
+            if training_step % SEND_EVERY == 0 and copy_stream is None:
+                parameter_bank.publish(learner_tensors)
+                print("[LEARNER] Sent updated parameters to actor")
+            elif training_step % SEND_EVERY == 0:
+                copy_stream.wait_stream(torch.cuda.current_stream())  # after optimizer.step()
+                with torch.cuda.stream(copy_stream):
+                    for host, tensor in zip(staging, learner_tensors):
+                        host.copy_(tensor.detach(), non_blocking=True)
+                # Overlaps with the next training step, only optimizer.step() waits for it
+                copy_done = copy_stream.record_event()
+
+        if copy_done is not None and copy_done.query():  # copy over, share with the actor
+            parameter_bank.publish(staging)
+            copy_done = None
+            print("[LEARNER] Sent updated parameters to actor")
 
     print("[LEARNER] Learner process finished")
@@ -3,17 +3,19 @@ import signal
 from typing import Callable
 from pathlib import Path
 
+import torch
 from lerobot.datasets.lerobot_dataset import LeRobotDataset
 from lerobot.datasets.utils import hw_to_dataset_features
 from lerobot.envs.configs import HILSerlProcessorConfig, HILSerlRobotEnvConfig
 from lerobot.policies.sac.configuration_sac import SACConfig
 from lerobot.policies.sac.modeling_sac import SACPolicy
 from lerobot.policies.sac.reward_model.modeling_classifier import Classifier
-from lerobot.rl.buffer import ReplayBuffer
 from lerobot.rl.gym_manipulator import make_robot_env
 from lerobot.robots.so100_follower import SO100FollowerConfig
 from lerobot.teleoperators.so100_leader import SO100LeaderConfig
 
+from utils import BatchedReplayBuffer, ParameterBank, TransitionRing, module_tensors
+
 
 run_learner: Callable = ...  # use/modify the functions defined earlier
 run_actor: Callable = ...
@@ -69,15 +71,33 @@ demonstrations_repo_id = "lerobot/example_hil_serl_dataset"
 offline_dataset = LeRobotDataset(repo_id=demonstrations_repo_id)
 
 # Online buffer: initialized from scratch
-online_replay_buffer = ReplayBuffer(device=device, state_keys=list(obs_features.keys()))
+online_replay_buffer = BatchedReplayBuffer(
+    device=device, state_keys=list(obs_features.keys())
+)
 # Offline buffer: Created from dataset (pre-populated it with demonstrations)
-offline_replay_buffer = ReplayBuffer.from_lerobot_dataset(
+offline_replay_buffer = BatchedReplayBuffer.from_lerobot_dataset(
     lerobot_dataset=offline_dataset, device=device, state_keys=list(obs_features.keys())
 )
 
 # Create communication channels between learner and actor processes
-transitions_queue = mp.Queue(maxsize=10)
-parameters_queue = mp.Queue(maxsize=2)
+state_fields = {  # camera frames are shared as uint8
+    key: (ft["shape"], torch.uint8 if ft["dtype"] in ("image", "video") else torch.float32)
+    for key, ft in obs_features.items()
+}
+transitions_ring = TransitionRing(  # episodes are written to (and read from) shared memory
+    fields={
+        "state": state_fields,
+        "action": (action_features["action"]["shape"], torch.float32),
+        "reward": ((), torch.float32),
+        "next_state": state_fields,
+        "done": ((), torch.bool),
+        "truncated": ((), torch.bool),
+        "complementary_info": {"is_intervention": ((), torch.bool)},
+    },
+    max_steps=MAX_STEPS_PER_EPISODE,
+)
+# Learner weights, shared with the actor in half precision (use torch.float16 on "mps")
+parameter_bank = ParameterBank(module_tensors(policy_learner), dtype=torch.bfloat16)
 shutdown_event = mp.Event()
 
 
@@ -94,8 +114,8 @@ signal.signal(signal.SIGTERM, signal_handler)
 learner_process = mp.Process(
     target=run_learner,
     args=(
-        transitions_queue,
-        parameters_queue,
+        transitions_ring,
+        parameter_bank,
         shutdown_event,
         policy_learner,
         online_replay_buffer,
@@ -107,8 +127,8 @@ learner_process = mp.Process(
 actor_process = mp.Process(
     target=run_actor,
     args=(
-        transitions_queue,
-        parameters_queue,
+        transitions_ring,
+        parameter_bank,
         shutdown_event,
         policy_actor,
         reward_classifier,
@@ -0,0 +1,281 @@
+import ctypes
+import multiprocessing as mp
+import time
+from typing import Callable
+
+import torch
+from lerobot.rl.buffer import ReplayBuffer
+
+
+def tree_map(fn, tree):
+    """Apply `fn` to every leaf of a (possibly nested) dictionary."""
+    if isinstance(tree, dict):
+        return {k: tree_map(fn, v) for k, v in tree.items()}
+    return fn(tree)
+
+
+def _write(dst, src, index):
+    for key, value in src.items():
+        if isinstance(dst[key], dict):
+            _write(dst[key], value, index)
+        else:
+            target = dst[key][index]
+            target.copy_(torch.as_tensor(value).reshape(target.shape))
+
+
+def normalize_images(obs: dict) -> dict:
+    """Casts uint8 camera frames to float in [0, 1], on the device they already live on."""
+    return {
+        k: v.float().mul_(1.0 / 255.0) if v.dtype == torch.uint8 else v for k, v in obs.items()
+    }
+
+
+class _PaddedCounter(ctypes.Structure):
+    # one counter per 64B cache line, so that producer and consumer never false-share
+    _fields_ = [("value", ctypes.c_uint64), ("_padding", ctypes.c_uint64 * 7)]
+
+
+class TransitionRing:
+    """Single-producer single-consumer ring of episodes, living in shared memory.
+
+    Every field is preallocated as a `(capacity, max_steps, *shape)` shared tensor: the actor
+    writes transitions in place, and the learner reads them back as views, without pickling.
+    Within a slot, autonomous transitions fill the rows from the front and human interventions
+    from the back, so that each is read as a single contiguous (already partitioned) batch."""
+
+    def __init__(self, fields: dict, max_steps: int, capacity: int = 8):
+        if capacity & (capacity - 1):
+            raise ValueError(f"Ring capacity must be a power of two, got {capacity}")
+
+        self.capacity = capacity
+        self.max_steps = max_steps
+        self.storage = tree_map(
+            lambda spec: torch.zeros((capacity, max_steps, *spec[0]), dtype=spec[1]),
+            fields,
+        )
+        tree_map(lambda field: field.share_memory_(), self.storage)
+        # number of autonomous and intervention transitions, per slot
+        self.lengths = torch.zeros((capacity, 2), dtype=torch.int64).share_memory_()
+
+        # Counters are accessed under their lock, which doubles as the release/acquire fence
+        self._head = mp.Value(_PaddedCounter)  # next episode to be read by the learner
+        self._tail = mp.Value(_PaddedCounter)  # next episode to be written by the actor
+
+    def _wait(self, ready: Callable[[], bool], timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while not ready():
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(1e-3)
+        return True
+
+    def reserve(self, timeout: float = 0.1) -> int | None:
+        """Producer: slot to write the next episode into, None if the ring stays full."""
+        tail = self._tail.value
+        if not self._wait(lambda: tail - self._head.value < self.capacity, timeout):
+            return None
+        return tail & (self.capacity - 1)
+
+    def write(self, slot: int, index: int, transition: dict, is_intervention: bool) -> None:
+        """Producer: copy a single transition in place, as the `index`-th autonomous (or
+        intervention, counting from the back) transition of `slot`."""
+        step = self.max_steps - 1 - index if is_intervention else index
+        _write(self.storage, transition, (slot, step))
+
+    def push(self, n_autonomous: int, n_interventions: int) -> None:
+        """Producer: publish the episode written in the reserved slot."""
+        tail = self._tail.value
+        self.lengths[tail & (self.capacity - 1)] = torch.tensor((n_autonomous, n_interventions))
+        self._tail.value = tail + 1
+
+    def pop(self, timeout: float = 0.1) -> tuple[dict, dict] | None:
+        """Consumer: oldest published episode, as (autonomous, interventions) views on the ring.
+        None if no episode arrives."""
+        head = self._head.value
+        if not self._wait(lambda: self._tail.value != head, timeout):
+            return None
+        slot = head & (self.capacity - 1)
+        n_autonomous, n_interventions = self.lengths[slot].tolist()
+        start = self.max_steps - n_interventions
+        return (
+            tree_map(lambda field: field[slot, :n_autonomous], self.storage),
+            tree_map(lambda field: field[slot, start:], self.storage),
+        )
+
+    def release(self) -> None:
+        """Consumer: hand the slot just read back to the producer."""
+        self._head.value = self._head.value + 1
+
+
+def module_tensors(module: torch.nn.Module) -> list[torch.Tensor]:
+    """Parameters and buffers of `module`, in the same order for every instance of its class."""
+    return [*module.parameters(), *module.buffers()]
+
+
+class ParameterBank:
+    """Double-buffered copy of a module's weights in shared memory, published via a version.
+
+    The learner writes into the inactive bank and bumps the version, while the actor copies the
+    active bank (the one matching the version parity) into its already-allocated parameters.
+    Weights are exchanged as flat lists of tensors (see `module_tensors`), skipping any
+    `state_dict` traversal, and floating point ones are stored in (half precision) `dtype`."""
+
+    def __init__(self, tensors: list[torch.Tensor], dtype: torch.dtype = torch.bfloat16):
+        def shared_copy(t: torch.Tensor) -> torch.Tensor:
+            t = t.detach().to("cpu", dtype if t.is_floating_point() else t.dtype, copy=True)
+            return t.share_memory_()
+
+        self.dtype = dtype
+        self.banks = [[shared_copy(t) for t in tensors] for _ in range(2)]
+        self._version = mp.Value("Q", 0)  # publishes completed
+        self._started = mp.Value("Q", 0)  # publishes started
+
+    def publish(self, tensors: list[torch.Tensor]) -> None:
+        """Learner: copy `tensors` into the inactive bank, then make it active."""
+        version = self._version.value
+        self._started.value = version + 1
+        with torch.no_grad():
+            for shared, tensor in zip(self.banks[(version + 1) & 1], tensors):
+                shared.copy_(tensor)
+
+        self._version.value = version + 1
+
+    def load_into(self, tensors: list[torch.Tensor], seen_version: int) -> int:
+        """Actor: copy the active bank into `tensors` in place, if newer than `seen_version`.
+        Returns the version `tensors` now hold, never leaving them torn."""
+        version = self._version.value
+        if version == seen_version:
+            return seen_version
+
+        while True:
+            with torch.no_grad():
+                for tensor, shared in zip(tensors, self.banks[version & 1]):
+                    tensor.copy_(shared)
+
+            # Publishes alternate banks, so the bank read is only overwritten once a second
+            # publish starts: in that case the copy may be torn, and the latest bank is read
+            if self._started.value - version < 2:
+                return version
+            version = self._version.value
+
+
+def _index_copy(dst, src, index):
+    for key, value in dst.items():
+        if isinstance(value, dict):
+            _index_copy(value, src[key], index)
+        else:
+            value.index_copy_(0, index, src[key].to(value.device, value.dtype))
+
+
+def _gather(src, out, index):
+    for key, value in out.items():
+        if isinstance(value, dict):
+            _gather(src[key], value, index)
+        elif value.dtype == src[key].dtype:
+            torch.index_select(src[key], 0, index, out=value)
+        else:  # casting
+            value.copy_(src[key][index])
+
+
+def _copy(dst, src, non_blocking):
+    for key, value in dst.items():
+        if isinstance(value, dict):
+            _copy(value, src[key], non_blocking)
+        else:
+            value.copy_(src[key], non_blocking=non_blocking)
+
+
+class BatchedReplayBuffer(ReplayBuffer):
+    """`ReplayBuffer` inserting whole batches of transitions at once, one copy per field."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._staging = None  # batch transitions are first gathered into, see `gather_into`
+        self._staging_copied = None
+
+    def _storage(self) -> dict:
+        if self.optimize_memory:  # next states are not stored, but read at the following index
+            raise ValueError("BatchedReplayBuffer does not support `optimize_memory=True`")
+
+        storage = {
+            "state": self.states,
+            "action": self.actions,
+            "reward": self.rewards,
+            "next_state": self.next_states,
+            "done": self.dones,
+            "truncated": self.truncateds,
+        }
+        if self.has_complementary_info:
+            storage["complementary_info"] = self.complementary_info
+        return storage
+
+    def add_batch(self, batch: dict) -> None:
+        """Adds `batch`, a dictionary of field-wise stacked transitions, to the buffer."""
+        n = len(batch["reward"])
+        if n == 0:
+            return
+
+        if not self.initialized:
+            first = tree_map(lambda field: field[0], batch)
+            self._initialize_storage(
+                state=first["state"],
+                action=first["action"],
+                complementary_info=first.get("complementary_info"),
+            )
+
+        # Positions to write to, wrapping around the end of the buffer
+        index = (self.position + torch.arange(n, device=self.storage_device)) % self.capacity
+        _index_copy(self._storage(), batch, index)
+
+        self.position = (self.position + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+
+    def _allocate(
+        self, batch_size: int, device: torch.device, pin_memory: bool = False
+    ) -> dict:
+        storage = self._storage()
+        storage.pop("complementary_info", None)
+        return tree_map(
+            lambda field: torch.empty(
+                (batch_size, *field.shape[1:]),
+                dtype=field.dtype,
+                device=device,
+                pin_memory=pin_memory,
+            ),
+            storage,
+        )
+
+    def empty_batch(self, batch_size: int, device: torch.device) -> dict:
+        """Preallocates `batch_size` transitions on `device`, to be filled by `gather_into`."""
+        batch = self._allocate(batch_size, device)
+        # Like in `sample`, flags are floats (they are used in the losses' arithmetic)
+        batch["done"] = batch["done"].float()
+        batch["truncated"] = batch["truncated"].float()
+        return batch
+
+    def gather_into(self, out: dict, index: torch.Tensor) -> None:
+        """Writes the transitions at `index` into the preallocated `out` batch, in place.
+
+        Transitions stored on another device are first gathered into a staging batch allocated
+        once next to the storage (pinned, for CUDA), then sent over with one copy per field."""
+        device, storage_device = out["reward"].device, self.rewards.device
+        if device == storage_device:
+            _gather(self._storage(), out, index)
+        else:
+            batch_size = len(index)
+            if self._staging is None or len(self._staging["reward"]) != batch_size:
+                pin_memory = storage_device.type == "cpu" and device.type == "cuda"
+                self._staging = self._allocate(batch_size, storage_device, pin_memory)
+            if self._staging_copied is not None:  # previous copies must be done reading it
+                self._staging_copied.synchronize()
+
+            _gather(self._storage(), self._staging, index)
+            _copy(out, self._staging, non_blocking=device.type == "cuda")
+            if device.type == "cuda":
+                self._staging_copied = torch.cuda.current_stream().record_event()
+
+        if self.use_drq:  # same image augmentation `sample` would apply
+            for frames in (out["state"], out["next_state"]):
+                for key in frames:
+                    if key.startswith("observation.image"):
+                        frames[key].copy_(self.image_augmentation_function(frames[key]))